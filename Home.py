@@ -537,7 +537,7 @@ def main():
                 with col1:
                     review_type = st.selectbox(
                         "📝 选择要下载的评论类型",
-                        ["全部评论", "positive", "neutral", "negative"],
+                        ["全部评论", "positive", "neutral", "negative", "unknown"],
                         help="选择特定类型的评论进行下载"
                     )
                 
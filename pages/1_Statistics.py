@@ -6,9 +6,37 @@ from utils import (
     analyze_by_group,
     create_rating_heatmap,
     create_rating_trend_chart,
-    save_fig_to_html
+    save_fig_to_html,
+    load_excel
 )
 import plotly.express as px
+import plotly.graph_objects as go
+
+# 预处理文件各列的读取类型，避免pandas逐列推断并减少object列
+# 文本列使用Arrow存储的字符串；数值和日期列保持NumPy类型，便于重采样和plotly绘图
+EXCEL_DTYPES = {
+    'ID': 'string[pyarrow]',
+    'Asin': 'category',
+    'Title': 'string[pyarrow]',
+    'Content': 'string[pyarrow]',
+    'Model': 'category',
+    'Review Type': 'category'
+}
+
+# Plotly图表前端配置：隐藏logo、随容器自适应
+PLOTLY_CONFIG = {
+    'displaylogo': False,
+    'responsive': True
+}
+
+# 分组分析维度：选项名称 -> (分组字段, 显示名称)
+ANALYSIS_DIMENSIONS = {
+    "按Asin分析": ('Asin', "ASIN"),
+    "按Asin+Model组合分析": (['Asin', 'Model'], "ASIN-Model组合")
+}
+
+# 会话中最多保留的上传文件缓存数量
+MAX_CACHED_FILES = 2
 
 # 设置页面配置
 st.set_page_config(
@@ -19,7 +47,7 @@ st.set_page_config(
 )
 
 # 自定义CSS样式 - 统一风格设计
-st.markdown("""
+PAGE_CSS = """
 <style>
     /* 主标题样式 */
     .main-header {
@@ -36,6 +64,8 @@ st.markdown("""
         color: #A23B72;
         font-size: 1.2em;
         margin-bottom: 2em;
+    }
+    
     /* 卡片样式 */
     .card {
         background-color: #f8f9fa;
@@ -46,8 +76,8 @@ st.markdown("""
         box-shadow: 0 4px 8px rgba(0,0,0,0.05);
     }
     
-    /* 统计卡片样式 */
-    .stat-card {
+    /* 统计指标卡片样式 */
+    [data-testid="stMetric"] {
         background: white;
         padding: 1.5rem;
         border-radius: 10px;
@@ -58,23 +88,16 @@ st.markdown("""
         transition: all 0.3s ease;
     }
     
-    .stat-card:hover {
+    [data-testid="stMetric"]:hover {
         transform: translateY(-5px);
         box-shadow: 0 6px 12px rgba(0,0,0,0.15);
     }
     
-    .stat-number {
-        font-size: 2rem;
+    [data-testid="stMetricValue"] {
         font-weight: bold;
         color: #2E86AB;
     }
     
-    .stat-label {
-        font-size: 0.9rem;
-        color: #6c757d;
-        margin-top: 0.5rem;
-    }
-    
     /* 按钮样式优化 */
     .stButton > button {
         background: linear-gradient(90deg, #2E86AB, #4a90e2);
@@ -146,19 +169,27 @@ st.markdown("""
         color: white !important;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(PAGE_CSS, unsafe_allow_html=True)
+
+def monthly_rating_trend(df):
+    """按月计算平均评分，在时间索引上重采样，只对结果的月份做字符串转换"""
+    trend_data = (df['Rating'].set_axis(df['Date'])
+                  .resample('MS').mean().dropna()
+                  .rename_axis('Month').reset_index())
+    trend_data['Month'] = trend_data['Month'].dt.strftime('%Y-%m')
+    return trend_data
 
 def create_overall_trend_chart(df):
     """创建整体评分趋势图"""
-    df['Month'] = df['Date'].dt.to_period('M').astype(str)
-    trend_data = df.groupby('Month')['Rating'].mean().reset_index()
+    trend_data = monthly_rating_trend(df)
     
     fig = px.line(trend_data, 
                   x='Month', 
                   y='Rating',
                   title='📈 整体评分趋势分析',
                   labels={'Rating': '平均评分', 'Month': '月份'},
-                  line_shape='spline')
+                  render_mode='webgl')
     
     fig.update_traces(line=dict(width=3), marker=dict(size=8))
     fig.update_layout(
@@ -172,7 +203,39 @@ def create_overall_trend_chart(df):
     fig.update_xaxes(tickangle=45)
     return fig
 
+def get_file_cache(uploaded_file):
+    """获取当前上传文件在会话中的缓存，超出上限时淘汰最久未使用的文件"""
+    file_caches = st.session_state.file_caches
+    # 重新插入以标记为最近使用
+    file_cache = file_caches.pop(uploaded_file.file_id, {})
+    file_caches[uploaded_file.file_id] = file_cache
+    while len(file_caches) > MAX_CACHED_FILES:
+        file_caches.pop(next(iter(file_caches)))
+    return file_cache
+
+def summarize_overview(df):
+    """汇总数据概览指标：行数、平均评分、ASIN数量和时间范围"""
+    return {
+        'rows': len(df.index),
+        'avg_rating': df['Rating'].mean(),
+        'asin_count': df['Asin'].nunique(),
+        'date_min': df['Date'].min().strftime('%Y-%m'),
+        'date_max': df['Date'].max().strftime('%Y-%m')
+    }
+
+def get_group_analysis(file_cache, df, dimension):
+    """获取指定维度的分组分析结果，基础分析和热力图共用同一份结果"""
+    group_analyses = file_cache.setdefault('group_analyses', {})
+    if dimension not in group_analyses:
+        group_by, _ = ANALYSIS_DIMENSIONS[dimension]
+        group_analyses[dimension] = analyze_by_group(df, group_by)
+    return group_analyses[dimension]
+
 def main():
+    # 初始化会话状态
+    if 'file_caches' not in st.session_state:
+        st.session_state.file_caches = {}
+    
     # 页面标题
     st.markdown('<div class="main-header">📈 Amazon评论分析 - 统计分析</div>', unsafe_allow_html=True)
     st.markdown('<div class="sub-header">评论基本统计分析</div>', unsafe_allow_html=True)
@@ -215,98 +278,67 @@ def main():
             # 显示文件信息
             st.success("✅ 文件上传成功！正在处理数据...")
             
-            with st.spinner('正在加载和验证数据...'):
-                df = pd.read_excel(uploaded_file)
+            # 同一文件的解析结果和统计结果只在首次上传时计算
+            file_cache = get_file_cache(uploaded_file)
+            if 'df' not in file_cache:
+                with st.spinner('正在加载和验证数据...'):
+                    df = load_excel(uploaded_file.getvalue(), uploaded_file.name, dtype=EXCEL_DTYPES)
+                    # 缺少Date列时交给下方的列校验给出提示，不能在读取时就按日期解析
+                    if 'Date' in df.columns:
+                        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+                    if 'Rating' in df.columns:
+                        # 评分均为整数时压缩为int8，含空值时保持浮点类型
+                        df['Rating'] = pd.to_numeric(df['Rating'], downcast='integer')
+                    file_cache['df'] = df
+            df = file_cache['df']
             
             # 验证是否是预处理后的文件
             required_columns = ['ID', 'Asin', 'Title', 'Content', 'Model', 'Rating', 'Date', 'Review Type']
-            if not all(col in df.columns for col in required_columns):
+            missing_columns = set(required_columns) - set(df.columns)
+            if missing_columns:
                 st.error("❌ 请上传预处理后的文件！预处理后的文件应包含以下列：" + ", ".join(required_columns))
                 return
+            if df.empty:
+                st.warning("⚠️ 文件中没有评论数据，请检查上传的文件。")
+                return
             
             # 显示数据基本信息
             st.markdown('<div class="sub-header">📊 数据概览</div>', unsafe_allow_html=True)
             
+            if 'overview' not in file_cache:
+                file_cache['overview'] = summarize_overview(df)
+            overview = file_cache['overview']
+            
             col1, col2 = st.columns(2)
             with col1:
-                st.markdown(f"""
-                <div class="stat-card">
-                    <div class="stat-number">{len(df)}</div>
-                    <div class="stat-label">📈 数据行数</div>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                st.markdown(f"""
-                <div class="stat-card">
-                    <div class="stat-number">{df['Rating'].mean():.2f}</div>
-                    <div class="stat-label">⭐ 平均评分</div>
-                </div>
-                """, unsafe_allow_html=True)
+                st.metric("📈 数据行数", f"{overview['rows']:,}")
+                st.metric("⭐ 平均评分", f"{overview['avg_rating']:.2f}")
             
             with col2:
-                st.markdown(f"""
-                <div class="stat-card">
-                    <div class="stat-number">{df['Asin'].nunique()}</div>
-                    <div class="stat-label">🏷️ ASIN数量</div>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                date_min = df['Date'].min().strftime('%Y-%m')
-                date_max = df['Date'].max().strftime('%Y-%m')
-                st.markdown(f"""
-                <div class="stat-card">
-                    <div class="stat-number">{date_min} 至 {date_max}</div>
-                    <div class="stat-label">📅 时间范围</div>
-                </div>
-                """, unsafe_allow_html=True)
+                st.metric("🏷️ ASIN数量", overview['asin_count'])
+                st.metric("📅 时间范围", f"{overview['date_min']} 至 {overview['date_max']}")
             
             # 整体评论分析
             st.markdown('<div class="sub-header">📈 整体评论分析</div>', unsafe_allow_html=True)
             
-            # 安全地获取统计数据
-            try:
-                stats_df, review_counts, review_percentages = calculate_review_stats(df)
-                
-                # 饼图和详细统计表
-                col1, col2 = st.columns([1, 1])
-                with col1:
-                    st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-                    pie_chart = create_pie_chart(review_counts)
-                    st.plotly_chart(pie_chart, use_container_width=True)
-                    st.markdown('</div>', unsafe_allow_html=True)
-                
-                with col2:
-                    st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-                    st.markdown("**📋 详细统计表**")
-                    st.dataframe(stats_df, use_container_width=True)
-                    st.markdown('</div>', unsafe_allow_html=True)
-                    
-            except Exception as stats_error:
-                st.warning(f"⚠️ 统计分析遇到问题: {str(stats_error)}")
-                st.info("正在使用基础统计信息...")
-                
-                # 基础统计作为备选方案
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("总评论数", len(df))
-                with col2:
-                    high_rating = len(df[df['Rating'] >= 4])
-                    st.metric("高评分(4-5星)", high_rating)
-                with col3:
-                    low_rating = len(df[df['Rating'] <= 2])
-                    st.metric("低评分(1-2星)", low_rating)
-                with col4:
-                    avg_rating = df['Rating'].mean()
-                    st.metric("平均评分", f"{avg_rating:.2f}")
-                
-                # 创建简单的评分分布图
-                rating_counts = df['Rating'].value_counts().sort_index()
-                fig_simple = px.bar(x=rating_counts.index, y=rating_counts.values,
-                                  title="评分分布", labels={'x': '评分', 'y': '数量'})
-                st.plotly_chart(fig_simple, use_container_width=True)
-                
-                # 为后续使用设置默认值
-                pie_chart = fig_simple
+            # 必要列和非空数据已在上方校验，统计计算不再需要异常兜底
+            if 'stats' not in file_cache:
+                file_cache['stats'] = calculate_review_stats(df)
+            stats_df, review_counts, review_percentages = file_cache['stats']
+            
+            # 饼图和详细统计表
+            col1, col2 = st.columns([1, 1])
+            with col1:
+                st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+                pie_chart = create_pie_chart(review_counts)
+                st.plotly_chart(pie_chart, use_container_width=True, config=PLOTLY_CONFIG)
+                st.markdown('</div>', unsafe_allow_html=True)
+            
+            with col2:
+                st.markdown('<div class="chart-container">', unsafe_allow_html=True)
+                st.markdown("**📋 详细统计表**")
+                st.dataframe(stats_df, use_container_width=True)
+                st.markdown('</div>', unsafe_allow_html=True)
             
             # 详细分析部分
             st.markdown('<div class="sub-header">🔍 详细分析</div>', unsafe_allow_html=True)
@@ -319,44 +351,15 @@ def main():
                     st.markdown('<div class="card">', unsafe_allow_html=True)
                     analysis_type = st.selectbox(
                         "选择基础分析维度",
-                        ["按Asin分析", "按Asin+Model组合分析"],
+                        list(ANALYSIS_DIMENSIONS),
                         help="选择不同的维度来查看评论统计"
                     )
+                    _, display_name = ANALYSIS_DIMENSIONS[analysis_type]
                     
-                    if analysis_type == "按Asin分析":
-                        group_by = 'Asin'
-                        display_name = "ASIN"
-                    else:
-                        group_by = ['Asin', 'Model']
-                        display_name = "ASIN-Model组合"
-                    
-                    # 获取分组分析结果
-                    try:
-                        group_stats, rating_dist_pct, group_by_trend = analyze_by_group(df, group_by)
-                        
-                        # 显示统计信息
-                        st.markdown(f"**📊 {display_name}评分统计信息：**")
-                        st.dataframe(group_stats, use_container_width=True)
-                    except Exception as group_error:
-                        st.warning(f"⚠️ 分组分析出现问题: {str(group_error)}")
-                        st.info("显示基础分组统计...")
-                        
-                        # 基础分组统计
-                        if isinstance(group_by, list):
-                            if all(col in df.columns for col in group_by):
-                                basic_stats = df.groupby(group_by)['Rating'].agg(['count', 'mean', 'std']).round(2)
-                            else:
-                                st.error("数据中缺少必要的列")
-                                basic_stats = pd.DataFrame()
-                        else:
-                            if group_by in df.columns:
-                                basic_stats = df.groupby(group_by)['Rating'].agg(['count', 'mean', 'std']).round(2)
-                            else:
-                                st.error("数据中缺少必要的列")
-                                basic_stats = pd.DataFrame()
-                        
-                        if not basic_stats.empty:
-                            st.dataframe(basic_stats, use_container_width=True)
+                    # 获取分组分析结果并显示统计信息
+                    group_stats, _, _ = get_group_analysis(file_cache, df, analysis_type)
+                    st.markdown(f"**📊 {display_name}评分统计信息：**")
+                    st.dataframe(group_stats, use_container_width=True)
                     st.markdown('</div>', unsafe_allow_html=True)
             
             with tab2:
@@ -364,54 +367,55 @@ def main():
                     st.markdown('<div class="card">', unsafe_allow_html=True)
                     heatmap_dimension = st.radio(
                         "选择热力图分析维度",
-                        ["按Asin分析", "按Asin+Model组合分析"],
+                        list(ANALYSIS_DIMENSIONS),
                         key="heatmap_dimension",
                         help="热力图可以直观显示不同维度的评分分布"
                     )
-                    
-                    # 根据选择的维度重新计算热力图数据
-                    if heatmap_dimension == "按Asin分析":
-                        heatmap_group_by = 'Asin'
-                        heatmap_display_name = "ASIN"
-                    else:
-                        heatmap_group_by = ['Asin', 'Model']
-                        heatmap_display_name = "ASIN-Model组合"
+                    heatmap_group_by, heatmap_display_name = ANALYSIS_DIMENSIONS[heatmap_dimension]
                     
                     try:
-                        _, heatmap_dist_pct, _ = analyze_by_group(df, heatmap_group_by)
+                        # 与基础分析共用已计算的分组结果
+                        _, heatmap_dist_pct, _ = get_group_analysis(file_cache, df, heatmap_dimension)
                         
                         st.markdown('<div class="chart-container">', unsafe_allow_html=True)
                         heatmap = create_rating_heatmap(heatmap_dist_pct, f"🔥 {heatmap_display_name}的评分分布(%)")
-                        st.plotly_chart(heatmap, use_container_width=True)
+                        # 数据维度不变时保留前端的缩放等交互状态，避免重新布局
+                        heatmap.update_layout(uirevision=heatmap_dimension)
+                        st.plotly_chart(heatmap, use_container_width=True, config=PLOTLY_CONFIG)
                         st.markdown('</div>', unsafe_allow_html=True)
-                    except Exception as heatmap_error:
+                    except (KeyError, ValueError, TypeError) as heatmap_error:
                         st.warning(f"⚠️ 热力图生成出现问题: {str(heatmap_error)}")
                         st.info("显示基础评分分布...")
                         
                         # 创建基础的评分分布图作为替代
                         if isinstance(heatmap_group_by, list):
                             if all(col in df.columns for col in heatmap_group_by):
-                                # 创建组合列用于分组
-                                df_temp = df.copy()
-                                df_temp['group_key'] = df_temp[heatmap_group_by].apply(lambda x: ' - '.join(x.astype(str)), axis=1)
-                                rating_by_group = df_temp.groupby(['group_key', 'Rating']).size().unstack(fill_value=0)
+                                # 创建组合键用于分组（独立的Series，无需复制整个DataFrame）
+                                asin_col, model_col = heatmap_group_by
+                                group_key = df[asin_col].astype(str).str.cat(df[model_col].astype(str), sep=' - ')
+                                rating_by_group = df.groupby([group_key, 'Rating']).size().unstack(fill_value=0)
                             else:
                                 st.error("数据中缺少必要的列")
                                 rating_by_group = pd.DataFrame()
                         else:
                             if heatmap_group_by in df.columns:
-                                rating_by_group = df.groupby([heatmap_group_by, 'Rating']).size().unstack(fill_value=0)
+                                rating_by_group = df.groupby([heatmap_group_by, 'Rating'], observed=True).size().unstack(fill_value=0)
                             else:
                                 st.error("数据中缺少必要的列")
                                 rating_by_group = pd.DataFrame()
                         
                         if not rating_by_group.empty:
-                            fig_alt = px.imshow(rating_by_group.values, 
-                                              x=rating_by_group.columns, 
-                                              y=rating_by_group.index,
-                                              title=f"{heatmap_display_name}评分分布热力图",
-                                              labels={'x': '评分', 'y': heatmap_display_name})
-                            st.plotly_chart(fig_alt, use_container_width=True)
+                            fig_alt = go.Figure(go.Heatmap(
+                                z=rating_by_group.values,
+                                x=rating_by_group.columns,
+                                y=rating_by_group.index,
+                                colorscale='RdYlGn',
+                                hovertemplate='%{y} | 评分 %{x}: %{z}<extra></extra>'))
+                            fig_alt.update_layout(
+                                title=f"{heatmap_display_name}评分分布热力图",
+                                xaxis_title='评分',
+                                yaxis_title=heatmap_display_name)
+                            st.plotly_chart(fig_alt, use_container_width=True, config=PLOTLY_CONFIG)
                             heatmap = fig_alt
                         else:
                             # 如果无法创建热力图，设置一个默认图表
@@ -432,7 +436,10 @@ def main():
                     try:
                         if view_specific != "查看整体趋势":
                             # 多选框选择ASIN
-                            all_asins = sorted(df['Asin'].unique())
+                            # ASIN列表只在首次上传时计算，category类型只需对类别本身排序
+                            if 'all_asins' not in file_cache:
+                                file_cache['all_asins'] = df['Asin'].cat.categories.sort_values().tolist()
+                            all_asins = file_cache['all_asins']
                             selected_asins = st.multiselect(
                                 "选择要查看的ASIN（可多选）",
                                 all_asins,
@@ -440,7 +447,8 @@ def main():
                             )
                             
                             if selected_asins:
-                                filtered_df = df[df['Asin'].isin(selected_asins)]
+                                # Asin为category类型，isin直接比较类别编码；只取趋势图需要的列，避免复制评论文本
+                                filtered_df = df.loc[df['Asin'].isin(selected_asins), ['Date', 'Rating', 'Asin']]
                                 trend_chart = create_rating_trend_chart(filtered_df, 'Asin')
                             else:
                                 # 如果没有选择，显示所有ASIN的趋势
@@ -448,25 +456,24 @@ def main():
                         else:
                             # 显示整体趋势
                             trend_chart = create_overall_trend_chart(df)
+                        trend_chart.update_layout(uirevision=view_specific)
                         
                         st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-                        st.plotly_chart(trend_chart, use_container_width=True)
+                        st.plotly_chart(trend_chart, use_container_width=True, config=PLOTLY_CONFIG)
                         st.markdown('</div>', unsafe_allow_html=True)
                         
-                    except Exception as trend_error:
+                    except (KeyError, ValueError, TypeError) as trend_error:
                         st.warning(f"⚠️ 趋势图生成出现问题: {str(trend_error)}")
                         st.info("显示基础趋势分析...")
                         
                         # 基础趋势图作为替代
                         if 'Date' in df.columns and 'Rating' in df.columns:
-                            df_trend = df.copy()
-                            df_trend['Month'] = pd.to_datetime(df_trend['Date']).dt.to_period('M').astype(str)
-                            monthly_avg = df_trend.groupby('Month')['Rating'].mean().reset_index()
+                            monthly_avg = monthly_rating_trend(df)
                             
                             trend_chart = px.line(monthly_avg, x='Month', y='Rating', 
                                                 title='月度平均评分趋势',
                                                 labels={'Rating': '平均评分', 'Month': '月份'})
-                            st.plotly_chart(trend_chart, use_container_width=True)
+                            st.plotly_chart(trend_chart, use_container_width=True, config=PLOTLY_CONFIG)
                         else:
                             st.error("缺少必要的日期或评分数据")
                             trend_chart = px.bar(title="无法生成趋势图")
@@ -8,9 +8,30 @@ st.set_page_config(
 )
 
 import pandas as pd
+import numpy as np
 import json
 import os
+import re
 from collections import defaultdict
+from utils import load_excel
+
+# 优先使用C实现的Aho-Corasick自动机做多关键词匹配，未安装时退回正则多选一匹配
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# 只有一个类别且关键词不超过该数量时改用正则匹配，其余情况使用自动机
+REGEX_MAX_KEYWORDS = 8
+
+# 关键词匹配只需要这几列，读取Excel时跳过其余列
+REQUIRED_COLUMNS = ['ID', 'Content', 'Review Type']
+
+# 评论内容用Arrow字符串存储，评论类型取值很少，用category存储
+EXCEL_DTYPES = {
+    'Content': 'string[pyarrow]',
+    'Review Type': 'category'
+}
 
 # 预设人群类别和关键词
 PRESET_CATEGORIES = {
@@ -20,11 +41,23 @@ PRESET_CATEGORIES = {
     "健身运动人群": "fitness,exercise,training,athlete,workout,gym,sports,muscle,strength,endurance,protein,Boosts endurance,Boosts strength"
 }
 
+# 预设类别的关键词列表，模块加载时拆分一次，侧边栏每次重跑直接使用
+PRESET_CATEGORIES_PARSED = {
+    name: [k.strip() for k in keywords.split(',') if k.strip()]
+    for name, keywords in PRESET_CATEGORIES.items()
+}
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def read_categories_file(mtime_ns, size):
+    """读取类别文件；以修改时间和大小为缓存键，文件未变化时重跑页面不再重复解析JSON"""
+    with open('categories.json', 'r', encoding='utf-8') as f:
+        return json.load(f)
+
 def load_categories():
     """从文件加载已保存的类别和关键词"""
     if os.path.exists('categories.json'):
-        with open('categories.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
+        stat = os.stat('categories.json')
+        return read_categories_file(stat.st_mtime_ns, stat.st_size)
     return {}
 
 def save_categories(categories):
@@ -32,32 +65,113 @@ def save_categories(categories):
     with open('categories.json', 'w', encoding='utf-8') as f:
         json.dump(categories, f, ensure_ascii=False, indent=2)
 
-def match_keywords(text, keywords):
-    """检查文本是否包含关键词列表中的任何词"""
-    if pd.isna(text):
-        return False
-    text = str(text).lower()
-    return any(keyword.lower().strip() in text for keyword in keywords)
+@st.cache_data(show_spinner=False)
+def parse_categories(categories):
+    """把逗号分隔的关键词字符串拆成小写关键词列表"""
+    # 忽略空关键词（如末尾多余的逗号），否则会匹配所有评论
+    return {
+        category: [k.strip().lower() for k in keywords.split(',') if k.strip()]
+        for category, keywords in categories.items()
+    }
+
+@st.cache_resource(show_spinner=False)
+def build_pattern(keywords):
+    """将关键词列表编译为一个多选一正则，关键词按字面匹配"""
+    return re.compile('|'.join(map(re.escape, keywords)))
+
+@st.cache_resource(show_spinner=False)
+def build_automaton(category_keywords):
+    """将所有类别的关键词编译进同一个Aho-Corasick自动机，值为包含该关键词的类别位掩码"""
+    owners = defaultdict(int)
+    for index, keywords in enumerate(category_keywords):
+        for keyword in keywords:
+            owners[keyword] |= 1 << index
+    automaton = ahocorasick.Automaton()
+    for keyword, mask in owners.items():
+        automaton.add_word(keyword, mask)
+    automaton.make_automaton()
+    return automaton
 
-def analyze_reviews(df, categories):
-    """分析评论并进行分类"""
-    # 创建结果DataFrame，保留ID列
-    results = pd.DataFrame()
-    results['ID'] = df['ID']  # 保留原始ID
-    results['Content'] = df['Content']
-    results['Original Review Type'] = df['Review Type']
+def scan_masks(automaton, texts):
+    """逐条扫描评论，返回每条评论命中类别的位掩码"""
+    masks = []
+    for text in texts:
+        mask = 0
+        for _, bits in automaton.iter(text):
+            mask |= bits
+        masks.append(mask)
+    return masks
+
+def scan_with_automaton(content_lower, category_keywords, first_match):
+    """用合并的Aho-Corasick自动机扫描评论，返回 评论数×类别数 的布尔矩阵"""
+    n_categories = len(category_keywords)
+    hits = np.zeros((len(content_lower), n_categories), dtype=bool)
+    if not any(category_keywords):
+        return hits
+    # 每条评论只扫描一遍，循环内只做整数按位或，命中的类别记在位掩码里
+    automaton = build_automaton(category_keywords)
+    masks = scan_masks(automaton, content_lower.to_numpy())
+    if first_match:
+        # 只保留最低位，即排在最前的命中类别
+        masks = [mask & -mask for mask in masks]
+    # 按每64个类别一组把位掩码展开成布尔列
+    for start in range(0, n_categories, 64):
+        width = min(64, n_categories - start)
+        words = np.fromiter(((mask >> start) & 0xFFFFFFFFFFFFFFFF for mask in masks),
+                            dtype=np.uint64, count=len(masks))
+        hits[:, start:start + width] = (words[:, None] >> np.arange(width, dtype=np.uint64)) & np.uint64(1)
+    return hits
+
+def scan_with_patterns(content_lower, category_keywords, first_match):
+    """每个类别用一个多选一正则扫描评论，返回 评论数×类别数 的布尔矩阵"""
+    hits = np.zeros((len(content_lower), len(category_keywords)), dtype=bool)
+    # first_match时已归类的评论不再参与后续类别的扫描
+    remaining = np.ones(len(content_lower), dtype=bool)
+    for index, keywords in enumerate(category_keywords):
+        if keywords and remaining.any():
+            rows = np.flatnonzero(remaining)
+            matched = rows[content_lower.iloc[rows].str.contains(build_pattern(keywords), regex=True).to_numpy()]
+            hits[matched, index] = True
+            if first_match:
+                remaining[matched] = False
+    return hits
+
+def scan_categories(content_lower, category_keywords, strategy='all'):
+    """标记每条评论命中的类别，返回 评论数×类别数 的布尔矩阵
+
+    strategy为'first_match'时，每条评论只保留按类别顺序第一个命中的类别
+    """
+    first_match = strategy == 'first_match'
+    # 正则对每个类别各扫描一遍，只有一个类别且关键词很少时比自动机更快
+    filled = [keywords for keywords in category_keywords if keywords]
+    if ahocorasick is None or (len(filled) == 1 and len(filled[0]) <= REGEX_MAX_KEYWORDS):
+        return scan_with_patterns(content_lower, category_keywords, first_match)
+    return scan_with_automaton(content_lower, category_keywords, first_match)
+
+def analyze_reviews(df, categories, strategy='all'):
+    """分析评论并进行分类，strategy为'first_match'时每条评论最多归入一个类别"""
+    # 评论内容只转小写一次，供所有类别共用
+    content_lower = df['Content'].fillna('').astype(str).str.lower()
     
-    # 为每个类别创建一列
-    for category in categories:
-        keywords = [k.strip() for k in categories[category].split(',')]
-        results[f'Is {category}'] = df['Content'].apply(
-            lambda x: match_keywords(x, keywords)
-        )
+    category_keywords = list(parse_categories(categories).values())
+    
+    # 重复的评论内容只匹配一次，再按编码映射回每一行
+    codes, unique_texts = pd.factorize(content_lower)
+    hits = scan_categories(pd.Series(unique_texts), category_keywords, strategy)[codes]
+    
+    # 创建结果DataFrame，保留ID列；各类别的匹配列由布尔矩阵一次性生成
+    results = pd.concat([
+        pd.DataFrame({
+            'ID': df['ID'],  # 保留原始ID
+            'Content': df['Content'],
+            'Original Review Type': df['Review Type']
+        }),
+        pd.DataFrame(hits, columns=[f'Is {category}' for category in categories], index=df.index)
+    ], axis=1)
     
     # 统计每个类别的匹配数量
     stats = {}
-    for category in categories:
-        matched = results[f'Is {category}'].sum()
+    for category, matched in zip(categories, hits.sum(axis=0)):
         stats[category] = {
             'matched': int(matched),
             'percentage': round(matched / len(df) * 100, 2)
@@ -122,10 +236,10 @@ def main():
                 st.markdown(f"**{preset_name}**")
                 
                 # 显示关键词预览
-                preview_keywords = preset_keywords.split(',')[:5]
-                preview_text = ', '.join(preview_keywords)
-                if len(preset_keywords.split(',')) > 5:
-                    preview_text += f"... (共{len(preset_keywords.split(','))}个关键词)"
+                preset_keyword_list = PRESET_CATEGORIES_PARSED[preset_name]
+                preview_text = ', '.join(preset_keyword_list[:5])
+                if len(preset_keyword_list) > 5:
+                    preview_text += f"... (共{len(preset_keyword_list)}个关键词)"
                 
                 st.markdown(f"<small style='color: #666;'>{preview_text}</small>", unsafe_allow_html=True)
                 
@@ -177,9 +291,8 @@ def main():
             
             # 显示类别概览
             category_summary = []
-            for cat, keywords in categories.items():
-                keyword_count = len([k for k in keywords.split(',') if k.strip()]) if keywords else 0
-                category_summary.append({"类别": cat, "关键词数": keyword_count})
+            for cat, keywords in parse_categories(categories).items():
+                category_summary.append({"类别": cat, "关键词数": len(keywords)})
             
             if category_summary:
                 summary_df = pd.DataFrame(category_summary)
@@ -251,19 +364,27 @@ def main():
         if uploaded_file is not None:
             try:
                 with st.spinner('正在处理文件...'):
-                    df = pd.read_excel(uploaded_file)
+                    df = load_excel(uploaded_file.getvalue(), uploaded_file.name,
+                                    dtype=EXCEL_DTYPES, usecols=REQUIRED_COLUMNS)
                 
                 # 验证文件格式
-                required_columns = ['ID', 'Content', 'Review Type']
-                if not all(col in df.columns for col in required_columns):
+                if not all(col in df.columns for col in REQUIRED_COLUMNS):
                     st.error("❌ 请上传包含ID、Content和Review Type列的预处理文件！")
                     return
                 
                 st.success(f"✅ 文件上传成功！共 {len(df)} 条评论")
                 
+                first_match_only = st.checkbox(
+                    "每条评论只归入第一个匹配的类别",
+                    value=False,
+                    help="评论同时命中多个类别时，只计入排在最前面的类别"
+                )
+                
                 # 分析评论
                 with st.spinner('正在分析评论...'):
-                    results, stats = analyze_reviews(df, categories)
+                    results, stats = analyze_reviews(
+                        df, categories, strategy='first_match' if first_match_only else 'all'
+                    )
                 
                 # 显示统计信息
                 st.markdown("### 📈 匹配统计结果")
@@ -1,78 +1,89 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import io
+import xlsxwriter
+
+# 优先使用Rust实现的calamine引擎读取xlsx，未安装时退回pandas默认引擎(openpyxl)
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
+
+# 导出Excel时每次转换的行数，避免一次性复制整个DataFrame
+EXCEL_CHUNK_ROWS = 10000
+
+# xlsx单个工作表的最大行数和列数（行数包含表头）
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLS = 16384
 
 def process_data(df):
     """数据预处理函数"""
-    # 确保所需列存在
+    # 确保所需列存在，一次列出所有缺少的列
     required_columns = ['Asin', 'Title', 'Content', 'Model', 'Rating', 'Date']
-    for col in required_columns:
-        if col not in df.columns:
-            st.error(f"缺少必要的列: {col}")
-            return None
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        st.error(f"缺少必要的列: {', '.join(missing_columns)}")
+        return None
     
     # 数据预处理
     # 1. 只保留必要的列
-    df = df[required_columns].copy()
-    
-    # 2. 清理数据
-    # 处理Rating列，确保为数值类型
-    df['Rating'] = pd.to_numeric(df['Rating'], errors='coerce')
-    
-    # 处理日期列，确保为日期类型
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-    
-    # 清理文本列中的空白字符
+    # 2. 清理数据：通过assign一次生成新的DataFrame，无需先复制再逐列赋值
     text_columns = ['Title', 'Content', 'Model']
-    for col in text_columns:
-        df[col] = df[col].astype(str).str.strip()
+    df = df[required_columns].assign(**{
+        # 处理Rating列，确保为数值类型；评分均为整数时压缩为int8，含空值时保持浮点类型
+        'Rating': pd.to_numeric(df['Rating'], errors='coerce', downcast='integer'),
+        # 处理日期列，确保为日期类型
+        'Date': pd.to_datetime(df['Date'], errors='coerce'),
+        # 清理文本列中的空白字符
+        **{col: df[col].astype(str).str.strip() for col in text_columns}
+    })
+    
+    # ASIN和型号重复值多，用category存储，分组时直接使用整数编码
+    df['Asin'] = df['Asin'].astype('category')
+    df['Model'] = df['Model'].astype('category')
     
     # 3. 添加ID列
-    df.insert(0, 'ID', range(1, len(df) + 1))
-    
-    # 4. 添加Review Type列
-    def get_review_type(rating):
-        try:
-            rating = float(rating)
-            if rating >= 4:
-                return 'positive'
-            elif rating == 3:
-                return 'neutral'
-            else:
-                return 'negative'
-        except:
-            return 'unknown'
-    
-    df['Review Type'] = df['Rating'].apply(get_review_type)
-    
-    # 5. 重新排序列
-    column_order = ['ID', 'Asin', 'Title', 'Content', 'Model', 'Rating', 'Date', 'Review Type']
-    df = df[column_order]
+    df.insert(0, 'ID', pd.to_numeric(np.arange(1, len(df) + 1), downcast='unsigned'))
+    
+    # 4. 添加Review Type列，按评分向量化划分；评分缺失或无法解析时标记为unknown
+    rating = df['Rating'].to_numpy(dtype=float)
+    codes = np.select([rating >= 4, rating == 3, np.isnan(rating)], [0, 1, 3], default=2)
+    df['Review Type'] = pd.Categorical.from_codes(
+        codes, categories=['positive', 'neutral', 'negative', 'unknown']
+    ).remove_unused_categories()
     
+    # ID插入在最前、Review Type追加在最后，列顺序已是ID, Asin, Title, Content, Model, Rating, Date, Review Type
     return df
 
+# 解析结果在所有会话间共享，只保留最近几个文件，避免历次上传的数据一直留在内存中
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_excel(file_bytes, file_name, dtype=None, usecols=None):
+    """读取上传的Excel文件，按文件内容缓存解析结果；指定usecols时只读取其中存在的列"""
+    return pd.read_excel(io.BytesIO(file_bytes), engine=EXCEL_ENGINE, dtype=dtype,
+                         usecols=(lambda col: col in usecols) if usecols is not None else None)
+
 def calculate_review_stats(df):
     """计算评论类型的统计信息"""
-    # 计算各类型数量
-    review_counts = df['Review Type'].value_counts()
-    
-    # 计算百分比
-    review_percentages = (review_counts / len(df) * 100).round(2)
+    # 计算各类型数量，category类型按类别顺序输出，无需再按数量排序
+    review_counts = df['Review Type'].value_counts(sort=False)
     
-    # 合并统计信息
+    # 合并统计信息，百分比直接在计数数组上计算
     stats_df = pd.DataFrame({
-        '数量': review_counts,
-        '占比(%)': review_percentages
-    })
+        '数量': review_counts.to_numpy(),
+        '占比(%)': np.round(review_counts.to_numpy() / len(df) * 100, 2)
+    }, index=review_counts.index)
+    review_percentages = stats_df['占比(%)']
     
     return stats_df, review_counts, review_percentages
 
 def create_pie_chart(review_counts, title='评论类型分布'):
     # 确保索引顺序与颜色映射一致
     review_counts = review_counts.reindex(
-        ['positive', 'neutral', 'negative'], 
+        ['positive', 'neutral', 'negative', 'unknown'], 
         fill_value=0
     )
     
@@ -91,9 +102,10 @@ def create_pie_chart(review_counts, title='评论类型分布'):
         color_discrete_map={
             'positive': '#2ECC71',  # 绿色
             'neutral': '#F1C40F',   # 黄色
-            'negative': '#E74C3C'   # 红色
+            'negative': '#E74C3C',  # 红色
+            'unknown': '#95A5A6'    # 灰色
         },
-        category_orders={'type': ['positive', 'neutral', 'negative']}
+        category_orders={'type': ['positive', 'neutral', 'negative', 'unknown']}
     )
     
     # 禁用主题干扰
@@ -105,34 +117,64 @@ def create_pie_chart(review_counts, title='评论类型分布'):
     )
     return fig
 
+def build_group_key(asin, model):
+    """由Asin和Model的类别编码构造"Asin - Model"组合键，只为出现过的组合拼接一次显示名称"""
+    asin = asin.astype('category')
+    model = model.astype('category')
+    asin_codes = asin.cat.codes.to_numpy(np.int64)
+    model_codes = model.cat.codes.to_numpy(np.int64)
+    # 缺失值的编码为-1；与字符串拼接时一样，任一列缺失的行组合键为空，分组时被丢弃
+    valid = (asin_codes >= 0) & (model_codes >= 0)
+    # 把两列的类别编码合成一个整数
+    width = len(model.cat.categories)
+    codes, pairs = pd.factorize(asin_codes[valid] * width + model_codes[valid])
+    asin_names = asin.cat.categories.astype(str)[pairs // width]
+    model_names = model.cat.categories.astype(str)[pairs % width]
+    labels = [f'{a} - {m}' for a, m in zip(asin_names, model_names)]
+    # 类别按名称排序，分组结果的顺序与按字符串分组时相同
+    categories, label_codes = np.unique(labels, return_inverse=True)
+    group_codes = np.full(len(asin), -1, dtype=np.int64)
+    group_codes[valid] = label_codes[codes]
+    return pd.Series(pd.Categorical.from_codes(group_codes, categories=categories),
+                     index=asin.index, name='Group')
+
+def sorted_type_counts(types, counts):
+    """按数量降序把各类型的数量转为字典，排序方式与value_counts相同，数量并列时的顺序也一致"""
+    # value_counts对计数按降序做sort_values：先反转数组再升序argsort，最后把结果反转回来
+    counts = np.array(counts, dtype=np.int64)[::-1]
+    order = (len(counts) - 1 - np.argsort(counts, kind='quicksort'))[::-1]
+    return {types[i]: int(counts[len(counts) - 1 - i]) for i in order}
+
 def analyze_by_group(df, group_by):
     """按指定字段进行分组分析"""
     if isinstance(group_by, list):
-        # 创建组合键
-        df['Group'] = df['Asin'] + ' - ' + df['Model']
-        # 按组合维度计算统计信息
-        group_stats = df.groupby('Group').agg({
-            'Rating': ['count', 'mean', 'std'],
-            'Review Type': lambda x: x.value_counts().to_dict()
-        }).round(2)
-        
-        # 计算组合维度的评分分布
-        rating_dist = df.groupby(['Group', 'Rating']).size().unstack(fill_value=0)
-        rating_dist_pct = rating_dist.div(rating_dist.sum(axis=1), axis=0) * 100
-        
-        group_by_trend = 'Group'
+        # 创建组合键（使用独立的Series，避免修改传入的DataFrame）
+        group_key = build_group_key(df['Asin'], df['Model'])
     else:
-        # 按ASIN维度计算统计信息
-        group_stats = df.groupby('Asin').agg({
-            'Rating': ['count', 'mean', 'std'],
-            'Review Type': lambda x: x.value_counts().to_dict()
-        }).round(2)
-        
-        # 计算ASIN维度的评分分布
-        rating_dist = df.groupby(['Asin', 'Rating']).size().unstack(fill_value=0)
-        rating_dist_pct = rating_dist.div(rating_dist.sum(axis=1), axis=0) * 100
-        
-        group_by_trend = 'Asin'
+        # 按ASIN维度分组
+        group_key = df['Asin']
+    
+    # 计算统计信息
+    group_stats = df.groupby(group_key, observed=True)['Rating'].agg(['count', 'mean', 'std']).round(2)
+    
+    # 评论类型分布：一次分组得到每组各类型的数量，只包含组内出现过的类型
+    positions = pd.Series(np.arange(len(df)), index=df.index)
+    type_counts = positions.groupby([group_key, df['Review Type']], observed=True).agg(['size', 'min'])
+    # 按组内首次出现的位置排列，与value_counts计数时得到的顺序相同
+    type_counts = type_counts.sort_values('min')
+    group_types = {}
+    for (group, review_type), count in zip(type_counts.index, type_counts['size'].tolist()):
+        types, counts = group_types.setdefault(group, ([], []))
+        types.append(review_type)
+        counts.append(count)
+    group_stats['评论类型分布'] = [sorted_type_counts(*group_types.get(group, ([], [])))
+                              for group in group_stats.index]
+    
+    # 计算评分分布：一次分组计数得到整数矩阵，再按行换算为百分比
+    rating_dist = df.groupby([group_key, 'Rating'], observed=True).size().unstack(fill_value=0)
+    rating_dist_pct = rating_dist.div(rating_dist.sum(axis=1), axis=0) * 100
+    
+    group_by_trend = group_key.name
     
     # 重命名列
     group_stats.columns = ['评论数量', '平均评分', '标准差', '评论类型分布']
@@ -141,9 +183,13 @@ def analyze_by_group(df, group_by):
 
 def create_rating_trend_chart(df, group_by):
     """创建评分趋势图"""
-    # 按时间和分组计算平均评分
-    df['Month'] = df['Date'].dt.to_period('M').astype(str)
-    trend_data = df.groupby(['Month', group_by])['Rating'].mean().reset_index()
+    # 按月份和分组计算平均评分，月份直接在日期列上分桶，只对结果做字符串转换
+    trend_data = (df.groupby([pd.Grouper(key='Date', freq='MS'), group_by], observed=True)['Rating']
+                  .mean().dropna()
+                  .rename_axis(['Month', group_by]).reset_index())
+    trend_data['Month'] = trend_data['Month'].dt.strftime('%Y-%m')
+    # 分组列可能为category类型，转为字符串避免plotly按未出现的类别分组
+    trend_data[group_by] = trend_data[group_by].astype(str)
     
     # 创建趋势图
     title = 'Asin-Model组合随时间的平均评分变化' if group_by == 'Group' else 'Asin随时间的平均评分变化'
@@ -153,7 +199,8 @@ def create_rating_trend_chart(df, group_by):
                   y='Rating', 
                   color=group_by,
                   title=title,
-                  labels={'Rating': '平均评分', 'Month': '月份'})
+                  labels={'Rating': '平均评分', 'Month': '月份'},
+                  render_mode='webgl')
     
     fig.update_xaxes(tickangle=45)
     return fig
@@ -180,14 +227,37 @@ def create_rating_heatmap(rating_dist_pct, title):
 
 def save_fig_to_html(fig, filename):
     """保存图表为HTML文件"""
-    return fig.to_html()
+    # 通过CDN引用plotly.js，避免在每个文件中内嵌约3MB的脚本
+    return fig.to_html(include_plotlyjs='cdn')
 
 def get_download_data(df, file_format='excel'):
     """准备下载数据"""
     if file_format == 'excel':
+        # 超出的行写入时只会被xlsxwriter忽略，这里先检查，与DataFrame.to_excel一样报错
+        n_rows, n_cols = len(df) + 1, len(df.columns)
+        if n_rows > EXCEL_MAX_ROWS or n_cols > EXCEL_MAX_COLS:
+            raise ValueError(
+                f"This sheet is too large! Your sheet size is: {n_rows}, {n_cols} "
+                f"Max sheet size is: {EXCEL_MAX_ROWS}, {EXCEL_MAX_COLS}"
+            )
         output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False)
+        # constant_memory模式下每写完一行就刷新到临时文件，内存占用不随行数增长；
+        # 该模式要求按行顺序写入，而DataFrame.to_excel按列写入单元格，所以这里逐行写入
+        workbook = xlsxwriter.Workbook(output, {
+            'constant_memory': True,
+            'default_date_format': 'YYYY-MM-DD HH:MM:SS',
+            'nan_inf_to_errors': True
+        })
+        worksheet = workbook.add_worksheet('Sheet1')
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+        # 分块转换为Python对象，空值写为空单元格
+        for start in range(0, len(df), EXCEL_CHUNK_ROWS):
+            chunk = df.iloc[start:start + EXCEL_CHUNK_ROWS]
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for row, values in enumerate(chunk.itertuples(index=False, name=None), start=start + 1):
+                worksheet.write_row(row, 0, values)
+        workbook.close()
         data = output.getvalue()
         return data
     else:  # txt format
@@ -200,10 +270,11 @@ def get_download_data(df, file_format='excel'):
         output.write('-' * 100 + '\n')  # 分隔线
         
         # 写入数据行
-        for _, row in df.iterrows():
-            # 确保所有值都转换为字符串，并处理可能的空值
-            row_values = [str(val) if pd.notna(val) else '' for val in row]
-            # 使用制表符分隔，这样在文本编辑器中会对齐
-            output.write('\t'.join(row_values) + '\n')
+        if len(df):
+            # 整表一次性转换为字符串，空值写为空串
+            text = df.astype(object).where(df.notna(), '').astype(str)
+            # 按列使用制表符拼接，这样在文本编辑器中会对齐
+            lines = text.iloc[:, 0].str.cat([text.iloc[:, i] for i in range(1, text.shape[1])], sep='\t')
+            output.write('\n'.join(lines) + '\n')
         
         return output.getvalue().encode('utf-8') 